@@ -1,29 +1,65 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
 from app.routers import analysis
+from app.services.gemini_service import GeminiService
 import logging
+import orjson
 
+class JsonFormatter(logging.Formatter):
+    # record.created is used as-is; skipping asctime avoids a strftime call
+    # per record, and the log pipeline can render timestamps itself.
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonFormatter())
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[log_handler]
 )
 
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.gemini = GeminiService()
+    await app.state.gemini.warmup()
+    yield
+    await app.state.gemini.aclose()
+
 app = FastAPI(
     title="Generative AI Code Analysis Service",
     description="AI-powered code documentation and analysis using Gemini",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+app.state.limiter = analysis.limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 app.include_router(analysis.router, prefix="/api/v1", tags=["analysis"])
@@ -42,4 +78,16 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    host = os.getenv("API_HOST", "0.0.0.0")
+    port = int(os.getenv("API_PORT", "8000"))
+    if os.getenv("DEV"):
+        uvicorn.run("app.main:app", host=host, port=port, reload=True)
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host=host,
+            port=port,
+            loop="uvloop",
+            http="httptools",
+            workers=int(os.getenv("WORKERS", "1"))
+        )
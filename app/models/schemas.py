@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List
 
 class CodeAnalysisRequest(BaseModel):
@@ -6,15 +6,18 @@ class CodeAnalysisRequest(BaseModel):
     language: str = Field(..., description="Programming language", examples=["python", "javascript", "java"])
     context: Optional[str] = Field(None, description="Additional context about the code")
     
-    model_config = {
-        "json_schema_extra": {
+    model_config = ConfigDict(
+        strict=True,
+        defer_build=False,
+        extra="forbid",
+        json_schema_extra={
             "examples": [{
                 "code": "def quicksort(arr):\n    if len(arr) <= 1:\n        return arr",
                 "language": "python",
                 "context": "Sorting algorithm implementation"
             }]
         }
-    }
+    )
 
 class CodeAnalysisResponse(BaseModel):
     analysis: str = Field(..., description="Detailed code analysis and explanation")
@@ -22,6 +25,8 @@ class CodeAnalysisResponse(BaseModel):
     suggestions: List[str] = Field(default_factory=list, description="Improvement suggestions")
     patterns_detected: List[str] = Field(default_factory=list, description="Design patterns identified")
     
+    model_config = ConfigDict(strict=True, defer_build=False, extra="forbid")
+    
 class ErrorResponse(BaseModel):
     error: str = Field(..., description="Error message")
     detail: Optional[str] = Field(None, description="Additional error details")
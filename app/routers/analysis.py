@@ -1,38 +1,137 @@
-from fastapi import APIRouter, HTTPException
+import os
+import re
+import xxhash
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from slowapi import Limiter
+from slowapi.util import get_remote_address
 from app.models.schemas import CodeAnalysisRequest, CodeAnalysisResponse, ErrorResponse
-from app.services.gemini_service import gemini_service
+from app.services.gemini_service import GeminiService
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
+# The default in-memory storage is per process; point RATE_LIMIT_STORAGE_URI
+# at shared storage (e.g. redis://) when running more than one worker.
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+)
+
+RATE_LIMIT = os.getenv("RATE_LIMIT", "60/minute")
+MAX_REQUEST_CODE_CHARS = int(os.getenv("MAX_REQUEST_CODE_CHARS", "200000"))
+# SSE treats CRLF, CR and LF all as line terminators; str.splitlines() would
+# also split on form feeds etc. and drop a trailing newline between chunks.
+_SSE_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+CACHE_CONTROL = f"private, max-age={os.getenv('CACHE_TTL_SECONDS', '3600')}"
+
+def get_gemini(request: Request) -> GeminiService:
+    return request.app.state.gemini
+
+async def validated_payload(payload: CodeAnalysisRequest) -> CodeAnalysisRequest:
+    if not payload.code.strip():
+        raise HTTPException(status_code=400, detail="Code cannot be empty")
+    
+    if len(payload.code) + len(payload.context or "") > MAX_REQUEST_CODE_CHARS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Code and context exceed the {MAX_REQUEST_CODE_CHARS} character limit"
+        )
+    
+    return payload
+
+def _request_etag(payload: CodeAnalysisRequest) -> str:
+    digest = xxhash.xxh3_128_hexdigest(payload.model_dump_json().encode())
+    return f'"{digest}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
 
 @router.post(
     "/analyze",
     response_model=CodeAnalysisResponse,
     responses={
+        304: {"description": "Not Modified"},
         400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+        429: {"model": ErrorResponse},
         500: {"model": ErrorResponse}
     },
     summary="Analyze code snippet",
     description="Submit code for AI-powered analysis and documentation generation"
 )
-async def analyze_code(request: CodeAnalysisRequest):
+@limiter.shared_limit(RATE_LIMIT, scope="analyze")
+async def analyze_code(
+    request: Request,
+    response: Response,
+    payload: CodeAnalysisRequest = Depends(validated_payload),
+    gemini: GeminiService = Depends(get_gemini)
+):
     try:
-        logger.info(f"Received analysis request for {request.language} code")
+        logger.info("Received analysis request for %s code", payload.language)
         
-        if not request.code.strip():
-            raise HTTPException(status_code=400, detail="Code cannot be empty")
+        etag = _request_etag(payload)
+        cache_headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if gemini.available and _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=cache_headers)
         
-        result = await gemini_service.analyze_code(
-            code=request.code,
-            language=request.language,
-            context=request.context
+        result = await gemini.analyze_code(
+            code=payload.code,
+            language=payload.language,
+            context=payload.context
         )
         
-        return CodeAnalysisResponse(**result)
+        # Canned fallback text must not be cached by the client, or a later
+        # If-None-Match would keep it pinned after Gemini recovers.
+        if not result.pop("fallback", False):
+            response.headers.update(cache_headers)
+        return CodeAnalysisResponse.model_construct(**result)
     
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Analysis failed: {e}")
+        logger.error("Analysis failed: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error during analysis")
+
+def _sse_event(data: str, event: Optional[str] = None) -> str:
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in _SSE_LINE_BREAK.split(data))
+    return "\n".join(lines) + "\n\n"
+
+@router.post(
+    "/analyze/stream",
+    responses={
+        400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+        429: {"model": ErrorResponse}
+    },
+    response_class=StreamingResponse,
+    summary="Stream code analysis",
+    description="Submit code for AI-powered analysis and receive the result as server-sent events"
+)
+@limiter.shared_limit(RATE_LIMIT, scope="analyze")
+async def analyze_code_stream(
+    request: Request,
+    payload: CodeAnalysisRequest = Depends(validated_payload),
+    gemini: GeminiService = Depends(get_gemini)
+):
+    logger.info("Received streaming analysis request for %s code", payload.language)
+    
+    async def events():
+        try:
+            async for text in gemini.stream_analysis(
+                code=payload.code,
+                language=payload.language,
+                context=payload.context
+            ):
+                yield _sse_event(text)
+            yield _sse_event("[DONE]", event="done")
+        except Exception as e:
+            logger.error("Streaming analysis failed: %s", e)
+            yield _sse_event("Internal server error during analysis", event="error")
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
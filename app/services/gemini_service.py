@@ -1,12 +1,149 @@
 import os
+import asyncio
 import logging
+import re
 from typing import Optional
+import orjson
+import xxhash
 import google.generativeai as genai
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
+MAX_CODE_CHARS = int(os.getenv("MAX_CODE_CHARS", "20000"))
+MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "2000"))
+# Each uvicorn worker holds its own token buckets, so the account-wide
+# quota is split evenly between them.
+WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("GEMINI_WARMUP_TIMEOUT_SECONDS", "5"))
+
+_TRAILING_WHITESPACE = re.compile(r"[ \t]+$", re.MULTILINE)
+_BLANK_LINE_RUNS = re.compile(r"\n{3,}")
+
+_PROMPT = """Analyze the following {language} code and provide:
+1. A detailed explanation of what the code does
+2. Time and space complexity analysis
+3. Suggestions for improvement
+4. Design patterns used (if any)
+
+Code:
+```{language}
+{code}
+```
+"""
+_PROMPT_WITH_CONTEXT = _PROMPT + "\nContext: {context}"
+
+# Mirrors CodeAnalysisResponse. Written out by hand because the Gemini Schema
+# proto rejects JSON-schema keywords such as "title" and "default" that
+# model_json_schema() emits.
+_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "analysis": {"type": "STRING"},
+        "complexity": {"type": "STRING", "nullable": True},
+        "suggestions": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "patterns_detected": {"type": "ARRAY", "items": {"type": "STRING"}}
+    },
+    "required": ["analysis", "suggestions", "patterns_detected"]
+}
+_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": _RESPONSE_SCHEMA
+}
+
+class BatchQueue:
+    """Collects prompts that arrive within a short window and dispatches them together.
+
+    Gemini has no multi-prompt endpoint, so a batch is sent as concurrent calls
+    over the shared client. The window does not cap concurrency: the worker
+    starts each batch and goes straight back to collecting, so every request
+    pays up to flush_interval of extra latency. Quota is enforced by the handler.
+    """
+    
+    def __init__(self, handler, flush_interval_ms: int = 20, max_batch: int = 16):
+        self._handler = handler
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatches: set = set()
+    
+    async def submit(self, prompt: str):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((prompt, future))
+        return await future
+    
+    async def aclose(self):
+        worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._fail(self._queue.get_nowait()[1])
+        dispatches = list(self._dispatches)
+        for task in dispatches:
+            task.cancel()
+        await asyncio.gather(*dispatches, return_exceptions=True)
+    
+    def _fail(self, future):
+        if not future.done():
+            future.set_exception(RuntimeError("BatchQueue closed"))
+    
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                await asyncio.sleep(self._flush_interval)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    self._fail(future)
+                raise
+            while len(batch) < self._max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, batch):
+        try:
+            results = await asyncio.gather(
+                *(self._handler(prompt) for prompt, _ in batch),
+                return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            for _, future in batch:
+                self._fail(future)
+            raise
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
 class GeminiService:
     def __init__(self):
+        self._cache = TTLCache(
+            maxsize=int(os.getenv("CACHE_MAX_SIZE", "10000")),
+            ttl=int(os.getenv("CACHE_TTL_SECONDS", "3600"))
+        )
+        self._batcher = BatchQueue(
+            self._call_gemini_api,
+            flush_interval_ms=int(os.getenv("BATCH_FLUSH_INTERVAL_MS", "20")),
+            max_batch=int(os.getenv("BATCH_MAX_SIZE", "16"))
+        )
+        self._inflight: dict = {}
+        self._rpm = AsyncLimiter(max(int(os.getenv("GEMINI_RPM", "60")) // WORKERS, 1), 60)
+        self._tpm = AsyncLimiter(max(int(os.getenv("GEMINI_TPM", "120000")) // WORKERS, 1), 60)
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             logger.warning("GEMINI_API_KEY not set, service will return mock responses")
@@ -16,48 +153,137 @@ class GeminiService:
             self.client = genai.GenerativeModel('gemini-1.5-pro')
             logger.info("Gemini service initialized successfully")
     
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+    
     async def analyze_code(self, code: str, language: str, context: Optional[str] = None) -> dict:
-        logger.info(f"Analyzing {language} code snippet")
+        logger.info("Analyzing %s code snippet", language)
         
         if not self.client:
             return self._mock_response(code, language)
         
+        prompt = self._build_prompt(self._normalize(code), language, self._truncate_context(context))
+        key = self._cache_key(prompt)
+        cached = self._cache.get(key)
+        if cached is not None:
+            logger.info("Cache hit for analysis request")
+            return cached
+        
+        # Identical prompts already in flight share one Gemini call. The call
+        # runs as its own task so a disconnecting caller cannot cancel it for
+        # the others still waiting.
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._fetch(key, prompt))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
         try:
-            prompt = self._build_prompt(code, language, context)
-            response = await self._call_gemini_api(prompt)
-            return self._parse_response(response)
+            return await asyncio.shield(inflight)
         except Exception as e:
-            logger.error(f"Gemini API error: {e}")
+            logger.error("Gemini API error: %s", e)
             return self._mock_response(code, language)
     
-    def _build_prompt(self, code: str, language: str, context: Optional[str]) -> str:
-        base_prompt = f"""Analyze the following {language} code and provide:
-1. A detailed explanation of what the code does
-2. Time and space complexity analysis
-3. Suggestions for improvement
-4. Design patterns used (if any)
-
-Code:
-```{language}
-{code}
-```
-"""
-        if context:
-            base_prompt += f"\nContext: {context}"
+    async def stream_analysis(self, code: str, language: str, context: Optional[str] = None):
+        logger.info("Streaming analysis of %s code snippet", language)
         
-        return base_prompt
+        if not self.client:
+            yield self._mock_response(code, language)["analysis"]
+            return
+        
+        prompt = self._build_prompt(self._normalize(code), language, self._truncate_context(context))
+        await self._acquire_quota(prompt)
+        logger.info("Calling Gemini API (streaming)")
+        response = await self.client.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+    
+    def _normalize(self, code: str) -> str:
+        # Canonicalize whitespace so trivially different pastes share a cache
+        # entry, and cap the size so one request cannot monopolize the quota.
+        code = code.replace("\r\n", "\n").replace("\r", "\n")
+        code = _TRAILING_WHITESPACE.sub("", code).strip("\n")
+        code = _BLANK_LINE_RUNS.sub("\n\n", code)
+        if len(code) > MAX_CODE_CHARS:
+            logger.warning("Truncating code snippet from %d to %d characters", len(code), MAX_CODE_CHARS)
+            code = code[:MAX_CODE_CHARS]
+        return code
+    
+    def _truncate_context(self, context: Optional[str]) -> Optional[str]:
+        if context and len(context) > MAX_CONTEXT_CHARS:
+            logger.warning("Truncating context from %d to %d characters", len(context), MAX_CONTEXT_CHARS)
+            return context[:MAX_CONTEXT_CHARS]
+        return context
+    
+    def _build_prompt(self, code: str, language: str, context: Optional[str]) -> str:
+        template = _PROMPT_WITH_CONTEXT if context else _PROMPT
+        return template.format(language=language, code=code, context=context)
+    
+    async def _fetch(self, key: str, prompt: str) -> dict:
+        response = await self._batcher.submit(prompt)
+        result = self._parse_response(response)
+        self._cache[key] = result
+        return result
+    
+    def _cache_key(self, prompt: str) -> str:
+        return xxhash.xxh3_128_hexdigest(prompt.encode())
+    
+    async def _acquire_quota(self, prompt: str):
+        # Roughly 4 characters per token; clamp so a single oversized prompt
+        # can still acquire the bucket instead of raising.
+        tokens = min(max(len(prompt) // 4, 1), self._tpm.max_rate)
+        await self._rpm.acquire()
+        await self._tpm.acquire(tokens)
     
     async def _call_gemini_api(self, prompt: str) -> str:
+        await self._acquire_quota(prompt)
         logger.info("Calling Gemini API")
-        response = self.client.generate_content(prompt)
+        response = await self.client.generate_content_async(
+            prompt,
+            generation_config=_GENERATION_CONFIG
+        )
         return response.text
     
+    async def warmup(self):
+        # count_tokens is free and does not count against generation quota, but
+        # still opens the gRPC channel and TLS session so the first real request
+        # does not pay the handshake. Bounded so a stalled network cannot hold
+        # up startup.
+        if not self.client:
+            return
+        try:
+            await asyncio.wait_for(
+                self.client.count_tokens_async("ping"),
+                timeout=WARMUP_TIMEOUT_SECONDS
+            )
+            logger.info("Gemini connection warmed up")
+        except Exception as e:
+            logger.warning("Gemini warmup failed: %s", e)
+    
+    async def aclose(self):
+        await self._batcher.aclose()
+        # The async SDK client holds a single gRPC channel that is shared
+        # by every request; close it on shutdown so pending streams drain.
+        async_client = getattr(self.client, "_async_client", None)
+        if async_client is not None:
+            await async_client.transport.close()
+            logger.info("Gemini async transport closed")
+    
     def _parse_response(self, response: str) -> dict:
+        try:
+            data = orjson.loads(response)
+        except orjson.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            logger.warning("Gemini returned non-JSON output, using raw text")
+            data = {"analysis": response}
+        complexity = data.get("complexity")
         return {
-            "analysis": response,
-            "complexity": None,
-            "suggestions": [],
-            "patterns_detected": []
+            "analysis": str(data.get("analysis", "")),
+            "complexity": str(complexity) if complexity is not None else None,
+            "suggestions": [str(item) for item in data.get("suggestions") or []],
+            "patterns_detected": [str(item) for item in data.get("patterns_detected") or []]
         }
     
     def _mock_response(self, code: str, language: str) -> dict:
@@ -73,7 +299,6 @@ Code:
                 "Consider adding unit tests",
                 "Optimize for performance if handling large datasets"
             ],
-            "patterns_detected": ["functional-programming", "iterative-approach"]
+            "patterns_detected": ["functional-programming", "iterative-approach"],
+            "fallback": True
         }
-
-gemini_service = GeminiService()
@@ -0,0 +1,37 @@
+import pytest
+from app.services.gemini_service import GeminiService
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield FakeResponse(chunk)
+
+class FakeClient:
+    stream_chunks = ["First line\nsecond", " line\rthird"]
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return FakeStream(self.stream_chunks)
+        return FakeResponse(
+            '{"analysis": "analysis text", "complexity": "O(1)",'
+            ' "suggestions": ["use a constant"], "patterns_detected": []}'
+        )
+
+@pytest.fixture
+def make_service():
+    def factory():
+        service = GeminiService()
+        service.client = FakeClient()
+        return service
+    return factory
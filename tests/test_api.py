@@ -1,19 +1,25 @@
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
+from app.models.schemas import CodeAnalysisRequest
+from app.routers.analysis import get_gemini, _request_etag
 
-client = TestClient(app)
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
 
-def test_health_check():
+def test_health_check(client):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["status"] == "healthy"
 
-def test_root_endpoint():
+def test_root_endpoint(client):
     response = client.get("/")
     assert response.status_code == 200
     assert "message" in response.json()
 
-def test_analyze_code_success():
+def test_analyze_code_success(client):
     payload = {
         "code": "def add(a, b):\n    return a + b",
         "language": "python"
@@ -25,7 +31,7 @@ def test_analyze_code_success():
     assert "suggestions" in data
     assert isinstance(data["suggestions"], list)
 
-def test_analyze_code_empty():
+def test_analyze_code_empty(client):
     payload = {
         "code": "",
         "language": "python"
@@ -33,7 +39,7 @@ def test_analyze_code_empty():
     response = client.post("/api/v1/analyze", json=payload)
     assert response.status_code == 422
 
-def test_analyze_code_with_context():
+def test_analyze_code_with_context(client):
     payload = {
         "code": "class Stack:\n    pass",
         "language": "python",
@@ -42,3 +48,103 @@ def test_analyze_code_with_context():
     response = client.post("/api/v1/analyze", json=payload)
     assert response.status_code == 200
     assert "analysis" in response.json()
+
+def test_analyze_code_stream(client):
+    payload = {
+        "code": "def add(a, b):\n    return a + b",
+        "language": "python"
+    }
+    response = client.post("/api/v1/analyze/stream", json=payload)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text.startswith("data: ")
+    assert "event: done" in response.text
+
+def test_analyze_code_etag_revalidation(client, make_service):
+    service = make_service()
+    app.dependency_overrides[get_gemini] = lambda: service
+    try:
+        payload = {
+            "code": "def add(a, b):\n    return a + b",
+            "language": "python"
+        }
+        response = client.post("/api/v1/analyze", json=payload)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert "max-age" in response.headers["cache-control"]
+        
+        response = client.post("/api/v1/analyze", json=payload, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+    finally:
+        app.dependency_overrides.clear()
+        client.portal.call(service.aclose)
+
+def test_analyze_code_fallback_is_not_cacheable(client):
+    payload = {
+        "code": "def add(a, b):\n    return a + b",
+        "language": "python"
+    }
+    etag = _request_etag(CodeAnalysisRequest(**payload))
+    response = client.post("/api/v1/analyze", json=payload, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert "cache-control" not in response.headers
+
+def test_analyze_code_rejects_unknown_fields(client):
+    payload = {
+        "code": "x = 1",
+        "language": "python",
+        "unexpected": True
+    }
+    response = client.post("/api/v1/analyze", json=payload)
+    assert response.status_code == 422
+
+def test_analyze_code_too_large(client):
+    payload = {
+        "code": "x" * 200_001,
+        "language": "python"
+    }
+    response = client.post("/api/v1/analyze", json=payload)
+    assert response.status_code == 413
+
+def test_analyze_code_stream_too_large(client):
+    payload = {
+        "code": "x" * 200_001,
+        "language": "python"
+    }
+    response = client.post("/api/v1/analyze/stream", json=payload)
+    assert response.status_code == 413
+
+def test_cors_exposes_etag(client):
+    response = client.get("/health", headers={"Origin": "http://localhost:3000"})
+    assert "etag" in response.headers["access-control-expose-headers"].lower()
+
+def test_analyze_code_stream_frames_model_chunks(client, make_service):
+    service = make_service()
+    app.dependency_overrides[get_gemini] = lambda: service
+    try:
+        payload = {
+            "code": "def add(a, b):\n    return a + b",
+            "language": "python"
+        }
+        response = client.post("/api/v1/analyze/stream", json=payload)
+        assert response.status_code == 200
+        assert response.text == (
+            "data: First line\ndata: second\n\n"
+            "data:  line\ndata: third\n\n"
+            "event: done\ndata: [DONE]\n\n"
+        )
+        assert service.client.calls == 1
+    finally:
+        app.dependency_overrides.clear()
+        client.portal.call(service.aclose)
+
+def test_analyze_code_context_counts_toward_size_limit(client):
+    payload = {
+        "code": "x = 1",
+        "language": "python",
+        "context": "c" * 200_000
+    }
+    response = client.post("/api/v1/analyze", json=payload)
+    assert response.status_code == 413
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from app.services.gemini_service import BatchQueue, GeminiService
+
+async def test_analyze_code_caches_identical_requests(make_service):
+    service = make_service()
+    first = await service.analyze_code("x = 1", "python")
+    second = await service.analyze_code("x = 1", "python")
+    assert first == second
+    assert service.client.calls == 1
+    await service.aclose()
+
+async def test_analyze_code_cache_distinguishes_context(make_service):
+    service = make_service()
+    await service.analyze_code("x = 1", "python")
+    await service.analyze_code("x = 1", "python", context="constant")
+    assert service.client.calls == 2
+    await service.aclose()
+
+async def test_concurrent_requests_are_dispatched_together(make_service):
+    service = make_service()
+    batch_sizes = []
+    dispatch = service._batcher._dispatch
+    
+    async def recording_dispatch(batch):
+        batch_sizes.append(len(batch))
+        await dispatch(batch)
+    
+    service._batcher._dispatch = recording_dispatch
+    results = await asyncio.gather(
+        service.analyze_code("a = 1", "python"),
+        service.analyze_code("b = 2", "python"),
+        service.analyze_code("c = 3", "python")
+    )
+    assert all(r["analysis"] == "analysis text" for r in results)
+    assert service.client.calls == 3
+    assert batch_sizes == [3]
+    await service.aclose()
+
+async def test_batch_queue_close_fails_pending_submissions():
+    async def never_returns(prompt):
+        await asyncio.Event().wait()
+    
+    queue = BatchQueue(never_returns, flush_interval_ms=1)
+    dispatched = asyncio.ensure_future(queue.submit("a"))
+    await asyncio.sleep(0.05)
+    queued = asyncio.ensure_future(queue.submit("b"))
+    await asyncio.sleep(0)
+    await queue.aclose()
+    for pending in (dispatched, queued):
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(pending, timeout=1)
+
+async def test_identical_inflight_requests_share_one_call(make_service):
+    service = make_service()
+    first, second = await asyncio.gather(
+        service.analyze_code("x = 1", "python"),
+        service.analyze_code("x = 1", "python")
+    )
+    assert first == second
+    assert service.client.calls == 1
+    await service.aclose()
+
+def test_parse_response_reads_structured_fields():
+    service = GeminiService()
+    result = service._parse_response(
+        '{"analysis": "adds numbers", "complexity": "O(1)", "suggestions": ["add type hints"]}'
+    )
+    assert result["analysis"] == "adds numbers"
+    assert result["complexity"] == "O(1)"
+    assert result["suggestions"] == ["add type hints"]
+    assert result["patterns_detected"] == []
+
+def test_parse_response_falls_back_to_raw_text():
+    service = GeminiService()
+    result = service._parse_response("plain text analysis")
+    assert result["analysis"] == "plain text analysis"
+    assert result["suggestions"] == []
+
+def test_normalize_collapses_whitespace_and_keeps_indentation():
+    service = GeminiService()
+    code = "\n\n    if x:   \n        y = 1\n\n\n\n    z = 2  \n\n"
+    assert service._normalize(code) == "    if x:\n        y = 1\n\n    z = 2"
+
+async def test_analyze_code_marks_fallback_on_api_error(make_service):
+    service = make_service()
+    
+    async def failing_call(prompt, **kwargs):
+        raise RuntimeError("quota exceeded")
+    
+    service.client.generate_content_async = failing_call
+    result = await service.analyze_code("x = 1", "python")
+    assert result["fallback"] is True
+    await service.aclose()
+
+async def test_warmup_uses_count_tokens_and_times_out(make_service, monkeypatch):
+    service = make_service()
+    
+    async def stalled_count_tokens(contents):
+        await asyncio.Event().wait()
+    
+    service.client.count_tokens_async = stalled_count_tokens
+    monkeypatch.setattr("app.services.gemini_service.WARMUP_TIMEOUT_SECONDS", 0.01)
+    await service.warmup()
+    assert service.client.calls == 0
+
+def test_normalize_handles_crlf_line_endings():
+    service = GeminiService()
+    code = "    if x:  \r\n        y = 1\r\n\r\n\r\n\r\n    z = 2\r\n"
+    assert service._normalize(code) == "    if x:\n        y = 1\n\n    z = 2"
+
+def test_truncate_context_caps_length(monkeypatch):
+    monkeypatch.setattr("app.services.gemini_service.MAX_CONTEXT_CHARS", 10)
+    service = GeminiService()
+    assert service._truncate_context("c" * 50) == "c" * 10
+    assert service._truncate_context(None) is None